@@ -1,22 +1,44 @@
+import asyncio
+import functools
+import hashlib
 import json
+import math
 from pathlib import Path
 import os
+import random
+import sys
+import threading
 import time
-from typing import List, Dict, Any
-from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields, replace
+import diskcache
+import httpx
+import numpy as np
+import pandas as pd
 from exa_py import Exa
 from ragas import evaluate
+from ragas.llms import BaseRagasLLM, llm_factory
 from ragas.metrics import faithfulness, answer_relevancy, context_precision
 from datasets import Dataset
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import numba
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    _NUMBA_AVAILABLE = False
+import tiktoken
+from aiolimiter import AsyncLimiter
+from tenacity import AsyncRetrying, RetryError, retry_if_exception_type, stop_after_attempt
 
 import openai
-from openai import OpenAI
-# Instead of `from openai.error import RateLimitError`
-# We'll detect if RateLimitError exists; if not, fallback to OpenAIError
-try:
-    RateLimitError = openai.RateLimitError
-except AttributeError:
-    RateLimitError = openai.OpenAIError
+from openai import AsyncOpenAI
 
 @dataclass
 class Source:
@@ -31,188 +53,984 @@ class LOOResult:
     full_quality: float
     metric_breakdown: Dict[str, float]
     per_source_impact: List[float]
-    sources_meta: List[Dict[str, str]]
-    per_source_metrics: List[Dict[str, Any]]   # new field
+    sources_meta: np.ndarray   # structured array with id/title/url fields, one record per source
+    per_source_metrics: pd.DataFrame   # one row per source: metrics of the answer without it, quality, impact
+    quality_scores: np.ndarray   # [full, loo_1, ..., loo_N], for downstream stats; NaN where a source was skipped as uninformative
+
+SOURCE_META_FIELDS = ("id", "title", "url")
+
+def sources_meta_array(records: List[Dict[str, str]]) -> np.ndarray:
+    # Each field is sized to its longest value so nothing gets truncated.
+    dtype = [(f, f"U{max((len(r[f]) for r in records), default=0) or 1}") for f in SOURCE_META_FIELDS]
+    return np.array([tuple(r[f] for f in SOURCE_META_FIELDS) for r in records], dtype=dtype)
+
+_exa_client: Optional[Exa] = None
+
+def get_exa_client() -> Exa:
+    global _exa_client
+    if _exa_client is None:
+        _exa_client = Exa(api_key=os.environ["EXA_API_KEY"])
+    return _exa_client
+
+def fetch_exa_content_batch(urls: List[str]) -> Dict[str, Source]:
+    # One get_contents round-trip for every URL; results are matched back by id/url.
+    response = get_exa_client().get_contents(urls, text=True)
+    requested = {normalize_url(u): u for u in urls}
+    sources = {}
+    for r in response.results:
+        for candidate in (r.id, r.url):
+            u = requested.get(normalize_url(candidate or ""))
+            if u is not None:
+                sources[u] = Source(
+                    id=r.id,
+                    title=r.title or "(untitled)",
+                    url=r.url,
+                    text=r.text or ""
+                )
+                break
+    return sources
 
 def fetch_exa_content(url: str) -> Source:
-    exa = Exa(api_key=os.environ["EXA_API_KEY"])
-    response = exa.get_contents([url], text=True)
-    if not response.results:
+    sources = fetch_exa_content_batch([url])
+    if url not in sources:
         raise RuntimeError(f"Exa get_contents returned no results for {url}")
-    r = response.results[0]
-    return Source(
-        id=r.id,
-        title=r.title or "(untitled)",
-        url=r.url,
-        text=r.text or ""
-    )
+    return sources[url]
 
 
 # --- Caching helpers ---
-def load_cache() -> Dict[str, dict]:
-    cache_path = Path("exa_cache.json")
+# Exa content is cached in two tiers: URL -> {sha1(text), id, title, url}, and
+# sha1 -> text, so mirrors of the same article store the text once but keep their
+# own metadata. Both tiers are append-only JSONL files (later lines win) that are
+# parsed once per process.
+EXA_CACHE_PATH = Path("exa_cache.json")  # legacy URL-keyed cache, migrated on first load
+URL_INDEX_PATH = Path("url_index.jsonl")
+CONTENT_STORE_PATH = Path("content_store.jsonl")
+LEGACY_RAGAS_CACHE_PATH = Path("ragas_cache.json")  # migrated on first load
+RAGAS_CACHE_PATH = Path("ragas_cache.jsonl")
+LOO_CACHE_DIR = Path(".loo_cache")
+# Bump whenever the prompt, model or scoring changes so stale LOO results are not reused.
+LOO_CACHE_VERSION = "5-gpt-4o"
+# Rewrite a JSONL cache once more than this fraction of its lines are superseded.
+COMPACT_STALE_FRACTION = 0.2
+
+def _json_loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_default(obj: Any) -> Any:
+    # NumPy arrays and scalars that orjson can't take natively (e.g. non-contiguous views).
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _json_dumps(obj: Any, indent: bool = False) -> bytes:
+    # Both paths emit UTF-8 without escaping non-ASCII text, and accept NumPy values.
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=_json_default, option=option)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+def _load_json(cache_path: Path) -> Dict[str, dict]:
     if cache_path.exists():
         try:
-            with cache_path.open("r", encoding="utf-8") as f:
-                return json.load(f)
+            with cache_path.open("rb") as f:
+                return _json_loads(f.read())
         except Exception as e:
-            print(f"Warning: Could not load cache: {e}")
+            print(f"Warning: Could not load cache {cache_path}: {e}")
             return {}
     return {}
 
-def save_cache(data: Dict[str, dict]):
-    cache_path = Path("exa_cache.json")
+def _save_json(cache_path: Path, data: Dict[str, dict]):
     try:
-        with cache_path.open("w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        with cache_path.open("wb") as f:
+            f.write(_json_dumps(data, indent=True))
     except Exception as e:
-        print(f"Warning: Could not save cache: {e}")
+        print(f"Warning: Could not save cache {cache_path}: {e}")
+
+def _load_jsonl(cache_path: Path) -> Tuple[Dict[str, Any], int, int]:
+    # Returns (data, parsed lines, unparsable lines). A torn line from an
+    # interrupted append is skipped on its own so later lines still load.
+    data, lines, bad = {}, 0, 0
+    if not cache_path.exists():
+        return data, lines, bad
+    try:
+        with cache_path.open("rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = _json_loads(line)
+                    data[record["key"]] = record["value"]
+                except Exception:
+                    bad += 1
+                    continue
+                lines += 1
+    except OSError as e:
+        print(f"Warning: Could not load cache {cache_path}: {e}")
+    if bad:
+        print(f"Warning: Skipped {bad} unreadable line(s) in {cache_path}.")
+    return data, lines, bad
+
+def _append_jsonl(cache_path: Path, key: str, value: Any):
+    try:
+        with cache_path.open("a+b") as f:
+            record = _json_dumps({"key": key, "value": value}) + b"\n"
+            # Start on a fresh line if a previous append was cut off mid-line.
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    record = b"\n" + record
+            f.write(record)
+    except Exception as e:
+        print(f"Warning: Could not save cache {cache_path}: {e}")
+
+def compact_cache_file(cache_path: Path, data: Dict[str, Any]):
+    tmp_path = cache_path.with_suffix(cache_path.suffix + ".tmp")
+    try:
+        with tmp_path.open("wb") as f:
+            for key, value in data.items():
+                f.write(_json_dumps({"key": key, "value": value}) + b"\n")
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"Warning: Could not compact cache {cache_path}: {e}")
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.lower().startswith("utm_")]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), parts.fragment))
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _source_entry(src: Source) -> Dict[str, str]:
+    return {"id": src.id, "title": src.title, "url": src.url, "text": src.text}
+
+_exa_cache: Optional[Tuple[Dict[str, dict], Dict[str, dict]]] = None
+_exa_cache_mtime: Tuple[float, float] = (0.0, 0.0)
+
+def _cache_mtime() -> Tuple[float, float]:
+    return tuple(p.stat().st_mtime if p.exists() else 0.0 for p in (URL_INDEX_PATH, CONTENT_STORE_PATH))
+
+def _cached_hash(url_index: Dict[str, dict], key: str) -> Optional[str]:
+    meta = url_index.get(key)
+    return meta["hash"] if meta is not None else None
+
+def _migrate_url_index(url_index: Dict[str, Any], content_store: Dict[str, dict]) -> bool:
+    # Older index lines map URL -> hash, with metadata kept next to the text, where
+    # the first URL seen with a given body wins. Keep only entries whose stored
+    # metadata belongs to that URL; the rest are refetched.
+    legacy = [k for k, v in url_index.items() if isinstance(v, str)]
+    for k in legacy:
+        h = url_index.pop(k)
+        entry = content_store.get(h)
+        if entry is not None and k in (normalize_url(entry.get("url", "")), normalize_url(entry.get("id", ""))):
+            url_index[k] = {"hash": h, "id": entry.get("id", k), "title": entry.get("title", "(untitled)"),
+                            "url": entry.get("url", k)}
+    return bool(legacy)
+
+def load_cache() -> Tuple[Dict[str, dict], Dict[str, dict]]:
+    global _exa_cache, _exa_cache_mtime
+    if _exa_cache is not None and _cache_mtime() == _exa_cache_mtime:
+        return _exa_cache
+
+    url_index, index_lines, index_bad = _load_jsonl(URL_INDEX_PATH)
+    content_store, store_lines, store_bad = _load_jsonl(CONTENT_STORE_PATH)
+    for path, data, lines, bad in ((URL_INDEX_PATH, url_index, index_lines, index_bad),
+                                   (CONTENT_STORE_PATH, content_store, store_lines, store_bad)):
+        # Never rewrite a file we could not fully read.
+        if not bad and lines and (lines - len(data)) / lines > COMPACT_STALE_FRACTION:
+            compact_cache_file(path, data)
+    if _migrate_url_index(url_index, content_store) and not index_bad:
+        compact_cache_file(URL_INDEX_PATH, url_index)
+    _exa_cache = (url_index, content_store)
+    _exa_cache_mtime = _cache_mtime()
+    _cached_source.cache_clear()
+
+    if not url_index and EXA_CACHE_PATH.exists():
+        for u, entry in _load_json(EXA_CACHE_PATH).items():
+            append_cache_entry(u, entry)
+    return _exa_cache
+
+def append_cache_entry(url: str, entry: Dict[str, str]) -> str:
+    global _exa_cache_mtime
+    url_index, content_store = load_cache()
+    key = normalize_url(url)
+    text = entry.get("text", "")
+    h = content_hash(text)
+    if h not in content_store:
+        content_store[h] = {"text": text}
+        _append_jsonl(CONTENT_STORE_PATH, h, content_store[h])
+    meta = {"hash": h, "id": entry.get("id", url), "title": entry.get("title", "(untitled)"),
+            "url": entry.get("url", url)}
+    if url_index.get(key) != meta:
+        url_index[key] = meta
+        _append_jsonl(URL_INDEX_PATH, key, meta)
+        _cached_source.cache_clear()
+    # Our own appends shouldn't force a re-read on the next load_cache().
+    _exa_cache_mtime = _cache_mtime()
+    return h
+
+@functools.lru_cache(maxsize=2048)
+def _cached_source(url: str) -> Source:
+    # Memoized per session; cleared whenever the cache is reloaded or a URL is remapped.
+    url_index, content_store = load_cache()
+    meta = url_index[normalize_url(url)]
+    # Defensive: ensure all fields exist
+    return Source(
+        id=meta.get("id", url),
+        title=meta.get("title", "(untitled)"),
+        url=meta.get("url", url),
+        text=content_store[meta["hash"]].get("text", "")
+    )
+
+def _fetch_missing(urls: List[str]) -> Dict[str, Tuple[Source, str]]:
+    try:
+        fetched = fetch_exa_content_batch(urls)
+    except Exception as e:
+        print(f"Warning: Could not fetch {len(urls)} URL(s) from Exa: {e}")
+        fetched = {}
+    for u in urls:
+        if u not in fetched:
+            print(f"Warning: Could not fetch {u}: Exa returned no content")
+    return {u: (src, append_cache_entry(u, _source_entry(src))) for u, src in fetched.items()}
 
 def build_sources(urls: List[str], exa_mocks: Dict[str, Dict[str, Any]]) -> List[Source]:
-    cache = load_cache()
+    url_index, content_store = load_cache()
+    # One fetch per normalized URL, using its first spelling, which is also the one
+    # the loop below keeps; aliases would otherwise be reported as failed fetches.
+    missing = []
+    seen_keys = set()
+    for u in urls:
+        key = normalize_url(u)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        if not (exa_mocks is not None and u in exa_mocks) and _cached_hash(url_index, key) not in content_store:
+            missing.append(u)
+    fetched = _fetch_missing(missing) if missing else {}
+
     sources = []
-    updated = False
+    seen_keys = set()
+    seen_hashes = set()
     for u in urls:
+        key = normalize_url(u)
+        # The same URL listed twice (or differing only by tracking params).
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
         if exa_mocks is not None and u in exa_mocks:
             m = exa_mocks[u]
             if "results" in m and m["results"]:
                 m = m["results"][0]
-            sources.append(Source(
+            src = Source(
                 id=m.get("id", u),
                 title=m.get("title", "(untitled)"),
                 url=m.get("url", u),
                 text=m.get("text", "")
-            ))
-        elif u in cache:
-            entry = cache[u]
-            # Defensive: ensure all fields exist
-            sources.append(Source(
-                id=entry.get("id", u),
-                title=entry.get("title", "(untitled)"),
-                url=entry.get("url", u),
-                text=entry.get("text", "")
-            ))
+            )
+            h = content_hash(src.text)
+        elif u in fetched:
+            src, h = fetched[u]
+        elif _cached_hash(url_index, key) in content_store:
+            h = url_index[key]["hash"]
+            src = _cached_source(u)
         else:
-            try:
-                src = fetch_exa_content(u)
-                # Save to cache
-                cache[u] = {
-                    "id": src.id,
-                    "title": src.title,
-                    "url": src.url,
-                    "text": src.text
-                }
-                sources.append(src)
-                updated = True
-            except Exception as e:
-                print(f"Warning: Could not fetch {u}: {e}")
-                continue
-    if updated:
-        save_cache(cache)
+            # Fetch failed; already reported by _fetch_missing.
+            continue
+        if h in seen_hashes:
+            # Mirrors would split one article's impact across two LOO slots.
+            print(f"Warning: {u} duplicates the content of an earlier source; skipping.")
+            continue
+        seen_hashes.add(h)
+        sources.append(src)
     return sources
 
+SYSTEM_PROMPT = (
+    "You are a factual answer generator.\n"
+    "Use ONLY the provided documents.\n"
+    "Every factual statement must cite a source like [S#].\n"
+    "Do not add outside knowledge."
+)
+
+def format_source_block(s: Source) -> str:
+    return f"{s.title} – {s.url}\n{s.text}"
+
+def build_prompt_from_blocks(query: str, blocks: List[str]) -> List[Dict[str, str]]:
+    # Blocks are numbered by position; LOO prompts reuse this numbering via build_loo_prompt.
+    # One join over all pieces so large source texts are copied exactly once.
+    parts: List[str] = [f'Question: "{query}"\n\nSources:\n']
+    for i, b in enumerate(blocks, 1):
+        if i > 1:
+            parts.append("\n\n")
+        parts.append(f"[S{i}] ")
+        parts.append(b)
+    user_msg = "".join(parts)
+    return [{"role":"system","content":SYSTEM_PROMPT},{"role":"user","content":user_msg}]
+
 def build_prompt(query: str, sources: List[Source]) -> List[Dict[str, str]]:
-    sys_msg = (
-        "You are a factual answer generator.\n"
-        "Use ONLY the provided documents.\n"
-        "Every factual statement must cite a source like [S#].\n"
-        "Do not add outside knowledge."
-    )
-    numbered_sources = []
-    for i, s in enumerate(sources, 1):
-        numbered_sources.append(f"[S{i}] {s.title} – {s.url}\n{s.text}")
-    user_msg = f'Question: "{query}"\n\nSources:\n' + "\n\n".join(numbered_sources)
-    return [{"role":"system","content":sys_msg},{"role":"user","content":user_msg}]
-
-def call_gpt4o(messages: List[Dict[str, str]]) -> str:
-    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-    max_retries = 3
-    delay = 10
-    for attempt in range(max_retries):
-        try:
-            resp = client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                temperature=0.0
+    return build_prompt_from_blocks(query, [format_source_block(s) for s in sources])
+
+def build_loo_prompt(full_messages: List[Dict[str, str]], i: int) -> List[Dict[str, str]]:
+    # The full prompt is kept byte-identical and the exclusion goes last, so every
+    # LOO call shares the full prompt as a prefix and hits OpenAI's prompt cache.
+    return full_messages + [{"role": "user", "content": f"For this answer, IGNORE source [S{i+1}] entirely."}]
+
+# --- Rate limiting ---
+OPENAI_RPM = int(os.environ.get("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.environ.get("OPENAI_TPM", "30000"))
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "16"))
+# Reply budget reserved per request on top of the prompt estimate.
+EXPECTED_COMPLETION_TOKENS = 1000
+
+# Built once on first use (loading the BPE ranks may hit the network) and shared
+# by every prompt, budget check and ablation afterwards.
+_encoding: Optional[tiktoken.Encoding] = None
+
+def get_encoding() -> tiktoken.Encoding:
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.encoding_for_model("gpt-4o")
+    return _encoding
+
+class TokenBucket:
+    """Per-minute token budget that refills continuously and is shared by all in-flight requests."""
+
+    def __init__(self, capacity: int, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.available = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        # A request larger than the whole bucket would be rejected by OpenAI anyway.
+        if tokens > self.capacity:
+            raise ValueError(
+                f"Request needs ~{tokens} tokens but the limit is {self.capacity} per minute (OPENAI_TPM)."
             )
-            return resp.choices[0].message.content
-        except RateLimitError as e:
-            # This catches RateLimitError or fallback OpenAIError (if RateLimitError is not available)
-            err_str = str(e)
-            if "Request too large" in err_str or "tokens per min" in err_str or "TPM" in err_str:
-                print("Warning: Request too large, truncating context to reduce tokens.")
-                for m in messages:
-                    if m["role"] == "user":
-                        m["content"] = m["content"][: len(m["content"]) // 2]
-                # retry
+        # No await between the check and the subtraction, so this is atomic on the event loop.
+        while True:
+            self._refill()
+            if self.available >= tokens:
+                self.available -= tokens
+                return
+            await asyncio.sleep((tokens - self.available) / self.rate)
+
+    def sync(self, remaining: int):
+        # Trust the server's view of the budget whenever it is tighter than ours.
+        self._refill()
+        self.available = min(self.available, float(remaining))
+
+_request_limiter = AsyncLimiter(OPENAI_RPM, 60)
+_token_bucket = TokenBucket(OPENAI_TPM)
+
+def count_prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    # ~4 tokens of chat framing per message. Not memoized: run-time callers pass
+    # precomputed sizes, so only small framing messages are counted here.
+    encoding = get_encoding()
+    return sum(len(encoding.encode(m["content"])) + 4 for m in messages)
+
+def estimate_tokens(messages: List[Dict[str, str]], prompt_tokens: Optional[int] = None) -> int:
+    # Callers that already know the prompt size pass it to skip re-encoding the prompt.
+    if prompt_tokens is None:
+        prompt_tokens = count_prompt_tokens(messages)
+    return prompt_tokens + EXPECTED_COMPLETION_TOKENS
+
+# --- Token budget ---
+MAX_PROMPT_TOKENS = int(os.environ.get("MAX_PROMPT_TOKENS", "100000"))
+# A prompt plus its reply must also fit in one minute's token allowance, or every retry is rejected.
+PROMPT_TOKEN_BUDGET = min(MAX_PROMPT_TOKENS, OPENAI_TPM - EXPECTED_COMPLETION_TOKENS)
+
+def tokenize_sources(sources: List[Source]) -> List[List[int]]:
+    encoding = get_encoding()
+    return [encoding.encode(s.text) for s in sources]
+
+def fit_sources_to_budget(
+    query: str,
+    sources: List[Source],
+    token_ids: List[List[int]],
+    max_tokens: int = PROMPT_TOKEN_BUDGET
+) -> Tuple[List[Source], List[List[int]]]:
+    # Everything but the source texts: system prompt, question, block headers, chat
+    # framing, and the exclusion turn of the longest LOO prompt.
+    empty = build_prompt(query, [replace(s, text="") for s in sources])
+    overhead = count_prompt_tokens(build_loo_prompt(empty, len(sources) - 1))
+    budget = max_tokens - overhead
+    total = sum(len(ids) for ids in token_ids)
+    if total <= budget:
+        return sources, token_ids
+    if budget <= 0:
+        raise ValueError(f"Prompt overhead alone ({overhead} tokens) exceeds the {max_tokens}-token budget.")
+    print(f"Warning: Sources total {total} tokens; truncating proportionally to fit {budget}.")
+    token_ids = [ids[: int(budget * len(ids) / total)] for ids in token_ids]
+    encoding = get_encoding()
+    return [replace(s, text=encoding.decode(ids)) for s, ids in zip(sources, token_ids)], token_ids
+
+# One client (and keep-alive connection pool) per event loop, so DNS and TLS
+# are paid once rather than per request.
+_async_client: Optional[AsyncOpenAI] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_async_client() -> AsyncOpenAI:
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    # httpx pools are bound to the loop they were opened on; a new asyncio.run() needs a new one.
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = AsyncOpenAI(
+            api_key=os.environ["OPENAI_API_KEY"],
+            # Retries belong to call_gpt4o_async, so each attempt passes the rate limiters.
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+            ),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+async def close_async_client():
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.close()
+    _async_client, _async_client_loop = None, None
+
+def run_async(coro):
+    # asyncio.run() that also closes the OpenAI client opened on its loop, so
+    # repeated runs don't leave connection pools behind.
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await close_async_client()
+    return asyncio.run(_main())
+
+MAX_RETRY_DELAY = 60
+
+def _retry_wait(retry_state) -> float:
+    # Honor Retry-After when the server sends one. Otherwise use full jitter under a
+    # 10s -> 20s -> 40s ceiling, so LOO calls throttled together don't retry together.
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        except ValueError:
+            pass  # HTTP-date form; fall back to backoff
+    ceiling = min(10 * 2 ** (retry_state.attempt_number - 1), MAX_RETRY_DELAY)
+    return random.uniform(0, ceiling)
+
+def _log_retry(retry_state):
+    e = retry_state.outcome.exception()
+    print(f"OpenAI error (attempt {retry_state.attempt_number}): {e}. "
+          f"Waiting {retry_state.next_action.sleep:.1f}s then retry.")
+
+async def call_gpt4o_async(messages: List[Dict[str, str]], prompt_tokens: Optional[int] = None) -> str:
+    client = get_async_client()
+    estimate = estimate_tokens(messages, prompt_tokens)
+    try:
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(3),
+            wait=_retry_wait,
+            retry=retry_if_exception_type(openai.APIError),
+            before_sleep=_log_retry,
+        ):
+            with attempt:
+                await _request_limiter.acquire()
+                await _token_bucket.acquire(estimate)
+                raw = await client.chat.completions.with_raw_response.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    temperature=0.0,
+                    stream=True
+                )
+                remaining_tokens = raw.headers.get("x-ratelimit-remaining-tokens")
+                if remaining_tokens is not None:
+                    _token_bucket.sync(int(remaining_tokens))
+                parts = []
+                # Leaving the block (including on cancellation) closes the stream right away.
+                async with raw.parse() as stream:
+                    async for chunk in stream:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                return "".join(parts)
+    except RetryError as e:
+        raise RuntimeError("Failed to call GPT-4o after retries due to rate limits or errors.") from e
+
+# --- RAGAS embeddings ---
+# answer_relevancy embeds the question for every row, plus the questions it generates.
+RAGAS_EMBEDDING_MODEL = "text-embedding-ada-002"  # RAGAS's own default
+EMBEDDING_CACHE_DIR = Path(".emb_cache")
+
+class MemoizedEmbeddings(Embeddings):
+    """Embeds each distinct text once, sending all unseen texts of a call in one request.
+
+    Vectors are L2-normalized and kept as FP16, both in memory for the session and
+    in a diskcache keyed by sha256(model, text), so repeat runs make no embedding
+    calls. Normalizing first keeps components in [-1, 1], where FP16 is most precise,
+    and leaves cosine similarity (all RAGAS computes from them) unchanged.
+    """
+
+    def __init__(self, inner: Embeddings, model: str, cache_dir: Path = EMBEDDING_CACHE_DIR):
+        self.inner = inner
+        self.model = model
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._disk = diskcache.Cache(str(cache_dir))
+
+    def _disk_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{text}".encode("utf-8")).hexdigest()
+
+    def _load_or_embed(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        found, to_embed = {}, []
+        for t in texts:
+            stored = self._disk.get(self._disk_key(t))
+            if stored is None:
+                to_embed.append(t)
             else:
-                print(f"Rate limit hit (attempt {attempt+1}/{max_retries}). Waiting {delay}s then retry.")
-                time.sleep(delay)
-                delay *= 2
-        except openai.APIError as e:  # catch broader API errors
-            print(f"OpenAI APIError: {e}. Waiting {delay}s then retry.")
-            time.sleep(delay)
-            delay *= 2
-        except Exception as e:
-            raise
-    raise RuntimeError("Failed to call GPT-4o after retries due to rate limits or errors.")
+                found[t] = stored
+        if to_embed:
+            for t, v in zip(to_embed, self.inner.embed_documents(to_embed)):
+                v = np.asarray(v, dtype=np.float32)
+                found[t] = (v / (np.linalg.norm(v) or 1.0)).astype(np.float16).tobytes()
+                self._disk.set(self._disk_key(t), found[t])
+        return {t: np.frombuffer(b, dtype=np.float16) for t, b in found.items()}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            missing = [t for t in dict.fromkeys(texts) if t not in self._vectors]
+        if missing:
+            vectors = self._load_or_embed(missing)
+            with self._lock:
+                self._vectors.update(vectors)
+        # Widened back to FP32 only on the way out.
+        with self._lock:
+            return [self._vectors[t].astype(np.float32).tolist() for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+_ragas_embeddings: Optional[MemoizedEmbeddings] = None
+
+def get_ragas_embeddings() -> MemoizedEmbeddings:
+    global _ragas_embeddings
+    if _ragas_embeddings is None:
+        _ragas_embeddings = MemoizedEmbeddings(OpenAIEmbeddings(model=RAGAS_EMBEDDING_MODEL), RAGAS_EMBEDDING_MODEL)
+    return _ragas_embeddings
+
+# evaluate() builds a fresh judge LLM wrapper on every call when none is passed;
+# one per process is enough (RAGAS's own default model, gpt-4o-mini).
+_ragas_llm: Optional[BaseRagasLLM] = None
+
+def get_ragas_llm() -> BaseRagasLLM:
+    global _ragas_llm
+    if _ragas_llm is None:
+        _ragas_llm = llm_factory()
+    return _ragas_llm
+
+QUALITY_METRICS = [faithfulness, answer_relevancy]
+# Quality is the weighted sum of the metric scores; equal weights give the plain average.
+METRIC_WEIGHTS = np.full(len(QUALITY_METRICS), 1 / len(QUALITY_METRICS))
+
+def metric_vector(scores: Dict[str, float]) -> np.ndarray:
+    return np.array([scores.get(m.name, np.nan) for m in QUALITY_METRICS])
+
+def _compute_impacts_py(metric_matrix: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    return (metric_matrix[0][None, :] - metric_matrix[1:]) @ weights
+
+if _NUMBA_AVAILABLE:
+    # No fastmath: failed judgements are NaN and must stay NaN.
+    @numba.njit(cache=True)
+    def _compute_impacts_jit(metric_matrix, weights):
+        n, d = metric_matrix.shape
+        out = np.empty(n - 1)
+        for i in range(1, n):
+            acc = 0.0
+            for j in range(d):
+                acc += (metric_matrix[0, j] - metric_matrix[i, j]) * weights[j]
+            out[i - 1] = acc
+        return out
+
+    compute_impacts = _compute_impacts_jit
+    compute_impacts(np.zeros((2, 1)), np.ones(1))  # compile now, not on the first run
+else:
+    compute_impacts = _compute_impacts_py
+
+_ragas_cache: Optional[Dict[str, dict]] = None
+_ragas_cache_lock = threading.Lock()
+
+def _ragas_cache_key(question: str, answer: str, contexts: List[str]) -> str:
+    # Stays on stdlib json so keys don't change depending on whether orjson is installed.
+    payload = json.dumps({"q": question, "a": answer, "c": sorted(contexts)}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def compute_quality_batch(
+    question: str,
+    answers: List[str],
+    contexts_list: List[List[str]]
+) -> List[tuple]:
+    global _ragas_cache
+    keys = [_ragas_cache_key(question, a, c) for a, c in zip(answers, contexts_list)]
+    with _ragas_cache_lock:
+        if _ragas_cache is None:
+            _ragas_cache, _, _ = _load_jsonl(RAGAS_CACHE_PATH)
+            if not _ragas_cache and LEGACY_RAGAS_CACHE_PATH.exists():
+                _ragas_cache = _load_json(LEGACY_RAGAS_CACHE_PATH)
+                compact_cache_file(RAGAS_CACHE_PATH, _ragas_cache)
+        hits = [_ragas_cache.get(k) for k in keys]
+    out = [(float(metric_vector(h["scores"]) @ METRIC_WEIGHTS), h["scores"]) if h is not None else None
+           for h in hits]
+    missing = [i for i, h in enumerate(hits) if h is None]
+    if not missing:
+        return out
+
+    # One evaluate() over every uncached row; RAGAS fans the judge calls out internally.
+    metrics = QUALITY_METRICS
+    # Columnar input lets Arrow build each column in one go instead of inferring row by row.
+    ds = Dataset.from_dict({
+        "question": [question] * len(missing),
+        "answer": [answers[i] for i in missing],
+        "contexts": [contexts_list[i] for i in missing]
+    })
+    # Every row shares the question: embed it once up front instead of once per row
+    # (rows are scored concurrently, so they would all miss together).
+    embeddings = get_ragas_embeddings()
+    embeddings.embed_documents([question])
+    result = evaluate(dataset=ds, metrics=metrics, llm=get_ragas_llm(), embeddings=embeddings)
+    df = result.to_pandas()
+
+    for pos, i in enumerate(missing):
+        row = df.iloc[pos]
+        scores = {m.name: float(row[m.name]) for m in metrics}
+        quality = float(metric_vector(scores) @ METRIC_WEIGHTS)
+        out[i] = (quality, scores)
+        # Don't persist failed judgements (RAGAS reports them as NaN).
+        if not any(math.isnan(v) for v in scores.values()):
+            with _ragas_cache_lock:
+                _ragas_cache[keys[i]] = {"quality": quality, "scores": scores}
+                _append_jsonl(RAGAS_CACHE_PATH, keys[i], _ragas_cache[keys[i]])
+    return out
+
+# Every evaluate() runs on this one thread. RAGAS keeps a per-thread event loop, and
+# the judge's pooled httpx connections (shared process-wide by langchain-openai)
+# break when reused from another loop, which the SDK then silently retries.
+_ragas_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ragas")
 
 def compute_quality(question: str, answer: str, contexts: List[str]) -> (float, Dict[str,float]):
-    metrics = [faithfulness, answer_relevancy]
-    ds = Dataset.from_list([{
-        "question": question,
-        "answer": answer,
-        "contexts": contexts
-    }])
-    result = evaluate(dataset=ds, metrics=metrics)
-    row = result.to_pandas().iloc[0]
-    scores = {m.name: float(row[m.name]) for m in metrics}
-    return float(sum(scores.values()) / len(scores)), scores
-
-def run_loo(
-    query: str,
-    urls: List[str],
-    exa_mocks: Dict[str, Dict[str, Any]]
-) -> LOOResult:
-
+    return _ragas_executor.submit(compute_quality_batch, question, [answer], [contexts]).result()[0]
+
+async def compute_quality_batch_async(
+    question: str,
+    answers: List[str],
+    contexts_list: List[List[str]]
+) -> List[tuple]:
+    # evaluate() blocks; run it off the event loop so pending generations keep flowing.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_ragas_executor, compute_quality_batch, question, answers, contexts_list)
+
+async def _score_as_completed(
+    question: str,
+    tasks: List[asyncio.Task],
+    contexts_list: List[List[str]]
+) -> List[tuple]:
+    # Two-stage pipeline: each time the scorer is free, score every answer that finished
+    # since the last batch while the remaining generations are still in flight.
+    position = {t: i for i, t in enumerate(tasks)}
+    qualities = [None] * len(tasks)
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            idx = []
+            for i in sorted(position[t] for t in done):
+                e = tasks[i].exception()
+                if e is None:
+                    idx.append(i)
+                elif i == 0:
+                    # Nothing to compare against without the full answer.
+                    raise e
+                else:
+                    print(f"Warning: A LOO generation failed: {e}. Its impact will be NaN.")
+                    qualities[i] = (float("nan"), {})
+            if not idx:
+                continue
+            scored = await compute_quality_batch_async(
+                question,
+                [tasks[i].result() for i in idx],
+                [contexts_list[i] for i in idx]
+            )
+            for i, q in zip(idx, scored):
+                qualities[i] = q
+    finally:
+        for t in pending:
+            t.cancel()
+    return qualities
+
+# --- LOO pruning ---
+# Sources below this size (login walls, 404 shells) get impact 0 without any API calls.
+MIN_INFORMATIVE_TOKENS = 50
+# Sources whose estimated Jaccard similarity over word 5-shingles reaches this
+# count as the same article (shared FAQ blocks, syndicated copies).
+NEAR_DUPLICATE_JACCARD = 0.9
+MINHASH_PERMUTATIONS = 64
+_MINHASH_PRIME = 4294967291  # largest prime below 2**32, so a*h + b fits in uint64
+_minhash_rng = np.random.default_rng(0)
+_MINHASH_A = _minhash_rng.integers(1, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _minhash_rng.integers(0, _MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+def minhash_signature(text: str) -> np.ndarray:
+    words = text.lower().split()
+    shingles = {" ".join(words[i:i + 5]) for i in range(max(1, len(words) - 4))}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(sh.encode("utf-8"), digest_size=4).digest(), "big") % _MINHASH_PRIME
+         for sh in shingles],
+        dtype=np.uint64
+    )
+    return ((_MINHASH_A[:, None] * hashes[None, :] + _MINHASH_B[:, None]) % _MINHASH_PRIME).min(axis=1)
+
+def plan_loo_skips(sources: List[Source], token_counts: List[int]) -> Dict[int, Optional[int]]:
+    # {i: None} for uninformative sources, {i: j} when source i near-duplicates earlier source j.
+    skips = {i: None for i, n in enumerate(token_counts) if n < MIN_INFORMATIVE_TOKENS}
+    informative = [i for i in range(len(sources)) if i not in skips]
+    if len(informative) < 2:
+        return skips
+    # All pairwise similarities in one vectorized comparison instead of a Python loop per pair.
+    sigs = np.stack([minhash_signature(sources[i].text) for i in informative])
+    similar = (sigs[:, None, :] == sigs[None, :, :]).mean(axis=2) >= NEAR_DUPLICATE_JACCARD
+    kept = []
+    for a, i in enumerate(informative):
+        twin = next((b for b in kept if similar[a, b]), None)
+        if twin is not None:
+            skips[i] = informative[twin]
+        else:
+            kept.append(a)
+    return skips
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+def _sources_key(sources: List[Source]) -> str:
+    # Keyed on content rather than URLs so edited mocks / refetched pages miss.
+    # Order is kept because per_source_impact is positional.
+    parts = [LOO_CACHE_VERSION, str(PROMPT_TOKEN_BUDGET), *(content_hash(s.text) for s in sources)]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+def _loo_cache_path(query: str, sources: List[Source]) -> Path:
+    key = hashlib.sha256(f"{_sources_key(sources)}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+    return LOO_CACHE_DIR / f"{key}.json"
+
+def load_loo_result(cache_path: Path) -> Optional[LOOResult]:
+    data = _load_json(cache_path)
+    if not data:
+        return None
+    try:
+        data["quality_scores"] = np.asarray(data["quality_scores"], dtype=float)
+        data["sources_meta"] = sources_meta_array(data["sources_meta"])
+        data["per_source_metrics"] = pd.DataFrame.from_dict(data["per_source_metrics"], orient="tight")
+        return LOOResult(**data)
+    except KeyError as e:
+        print(f"Warning: Ignoring incompatible LOO cache {cache_path}: missing {e}")
+        return None
+    except TypeError as e:
+        print(f"Warning: Ignoring incompatible LOO cache {cache_path}: {e}")
+        return None
+
+def save_loo_result(cache_path: Path, result: LOOResult):
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    # Shallow field copy: asdict would deep-copy the DataFrame and arrays only to serialize them.
+    data = {f.name: getattr(result, f.name) for f in fields(result)}
+    data["per_source_metrics"] = result.per_source_metrics.to_dict(orient="tight")
+    # Stored as a list of objects, like before, so the files stay readable.
+    data["sources_meta"] = [dict(zip(SOURCE_META_FIELDS, row)) for row in result.sources_meta.tolist()]
+    _save_json(cache_path, data)
+
+# --- Semantic query cache ---
+# Opt-in: a paraphrased query over the same sources reuses the earlier result when
+# the query embeddings reach this cosine similarity. ada-002 cosines of same-topic
+# questions sit in a narrow high band, so set it close to 1 (e.g. 0.98) if enabled.
+# Any value above 1, the default, disables the lookup.
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "1.01"))
+QUERY_INDEX_DIR = LOO_CACHE_DIR / "queries"
+
+_query_index: Optional[diskcache.Cache] = None
+
+def get_query_index() -> diskcache.Cache:
+    # sources key -> {normalized query: LOO cache file name}
+    global _query_index
+    if _query_index is None:
+        _query_index = diskcache.Cache(str(QUERY_INDEX_DIR))
+    return _query_index
+
+def find_similar_loo_result(query: str, sources_key: str) -> Optional[LOOResult]:
+    if SEMANTIC_CACHE_THRESHOLD > 1:
+        return None
+    seen = get_query_index().get(sources_key)
+    if not seen:
+        return None
+    query = normalize_query(query)
+    candidates = [q for q in seen if q != query]
+    if not candidates:
+        return None
+    try:
+        # The question embedding is needed by answer_relevancy anyway, so this costs
+        # at most one request, and stored queries come back from the embedding cache.
+        vectors = np.asarray(get_ragas_embeddings().embed_documents([query, *candidates]), dtype=np.float32)
+    except Exception as e:
+        print(f"Warning: Semantic cache lookup failed: {e}")
+        return None
+    sims = vectors[1:] @ vectors[0]
+    best = int(np.argmax(sims))
+    if sims[best] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    result = load_loo_result(LOO_CACHE_DIR / seen[candidates[best]])
+    if result is not None:
+        print(f"Reusing result for similar query {candidates[best]!r} (cosine {sims[best]:.3f}).")
+    return result
+
+def remember_loo_query(query: str, sources_key: str, cache_path: Path):
+    index = get_query_index()
+    with index.transact():
+        seen = index.get(sources_key) or {}
+        seen[normalize_query(query)] = cache_path.name
+        index.set(sources_key, seen)
+
+def _has_failed_scores(result: LOOResult) -> bool:
+    # Skipped sources are NaN in quality_scores by design; a NaN impact means a
+    # generation or judgement actually failed.
+    return math.isnan(result.full_quality) or bool(np.isnan(result.per_source_impact).any())
+
+# In-process tier in front of .loo_cache: a hit skips even source building.
+_loo_memory: Dict[str, LOOResult] = {}
+
+def _loo_request_key(query: str, urls: List[str], exa_mocks: Optional[Dict[str, Dict[str, Any]]]) -> str:
+    mocks = {u: exa_mocks[u] for u in urls if u in exa_mocks} if exa_mocks else {}
+    parts = [
+        hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest(),
+        hashlib.sha256(",".join(sorted(set(urls))).encode("utf-8")).hexdigest(),
+        # Editing a mock must not serve the old result.
+        hashlib.sha256(json.dumps(mocks, sort_keys=True, default=str).encode("utf-8")).hexdigest(),
+    ]
+    return ":".join(parts)
+
+def _memoize_loo(fn):
+    @functools.wraps(fn)
+    async def wrapper(query: str, urls: List[str], exa_mocks: Dict[str, Dict[str, Any]]) -> LOOResult:
+        key = _loo_request_key(query, urls, exa_mocks)
+        hit = _loo_memory.get(key)
+        if hit is not None:
+            return hit
+        result = await fn(query, urls, exa_mocks)
+        if not _has_failed_scores(result):
+            _loo_memory[key] = result
+        return result
+    return wrapper
+
+def retrieve_sources(urls: List[str], exa_mocks: Dict[str, Dict[str, Any]]) -> List[Source]:
     sources = build_sources(urls, exa_mocks)
     if not sources:
         raise ValueError("No sources available.")
+    # A deterministic order keeps the prompt prefix identical across runs and queries.
+    return sorted(sources, key=lambda s: s.url)
+
+async def evaluate_sources_async(query: str, sources: List[Source]) -> LOOResult:
+    cache_path = _loo_cache_path(query, sources)
+    # Taken before truncation, like cache_path, so lookups match what gets stored.
+    sources_key = _sources_key(sources)
+    cached = load_loo_result(cache_path)
+    if cached is None:
+        cached = find_similar_loo_result(query, sources_key)
+    if cached is not None:
+        return cached
+    # Truncating the full set up front means every LOO subset fits as well.
+    # Tokenize each source once; budgeting and the informativeness check share the ids.
+    sources, token_ids = fit_sources_to_budget(query, sources, tokenize_sources(sources))
+
+    skips = plan_loo_skips(sources, [len(ids) for ids in token_ids])
+    if skips:
+        print(f"Skipping LOO for {len(skips)} uninformative or near-duplicate source(s).")
+    run_idx = [i for i in range(len(sources)) if i not in skips]
+
+    # All remaining generations are independent, so issue them concurrently,
+    # at most MAX_CONCURRENT_REQUESTS at a time.
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def _generate(messages: List[Dict[str, str]], prompt_tokens: int) -> str:
+        async with semaphore:
+            return await call_gpt4o_async(messages, prompt_tokens)
 
     full_messages = build_prompt(query, sources)
-    full_answer = call_gpt4o(full_messages)
+    loo_msgs = [build_loo_prompt(full_messages, i) for i in run_idx]
+    # Prompt sizes come from the per-source token ids; only the small framing is encoded here.
+    full_tokens = (count_prompt_tokens(build_prompt(query, [replace(s, text="") for s in sources]))
+                   + sum(len(ids) for ids in token_ids))
+    prompt_tokens = [full_tokens, *(full_tokens + count_prompt_tokens(m[-1:]) for m in loo_msgs)]
+    tasks = [asyncio.create_task(_generate(m, n)) for m, n in zip([full_messages, *loo_msgs], prompt_tokens)]
+
+    # Answers are scored in batches as they arrive rather than after the last one lands.
     contexts_full = [s.text for s in sources]
-    full_quality, full_metrics = compute_quality(query, full_answer, contexts_full)
-
-    per_source_metrics = []  
-    # for i, s in enumerate(sources):
-    #     msg_i = build_prompt(query, [s])   
-    #     ans_i = call_gpt4o(msg_i)
-    #     contexts_i = [s.text]
-    #     quality_i, metrics_i = compute_quality(query, ans_i, contexts_i)
-    #     per_source_metrics.append({
-    #         "source_title": s.title,
-    #         "quality": quality_i,
-    #         **metrics_i  
-    #     })
-
-    impacts = []
-    for i in range(len(sources)):
-        subset = sources[:i] + sources[i+1:]
-        msg_lo = build_prompt(query, subset)
-        ans_lo = call_gpt4o(msg_lo)
-        contexts_lo = [t.text for t in subset]
-        quality_lo, _ = compute_quality(query, ans_lo, contexts_lo)
-        impacts.append(full_quality - quality_lo)
-
-    return LOOResult(
+    contexts_lo = [contexts_full[:i] + contexts_full[i+1:] for i in run_idx]
+    qualities = await _score_as_completed(query, tasks, [contexts_full, *contexts_lo])
+    full_answer = tasks[0].result()
+
+    # One row of metric scores per answer: [full, loo_1, ..., loo_N].
+    metric_matrix = np.full((len(sources) + 1, len(QUALITY_METRICS)), np.nan)
+    for row, (_, scores) in zip([0, *(i + 1 for i in run_idx)], qualities):
+        metric_matrix[row] = metric_vector(scores)
+    # Near-duplicates share their twin's scores. Uninformative sources were never
+    # measured: their rows stay NaN and their impact is set to 0 below.
+    uninformative = [i for i, twin in skips.items() if twin is None]
+    for i, twin in skips.items():
+        if twin is not None:
+            metric_matrix[i + 1] = metric_matrix[twin + 1]
+    quality_scores = metric_matrix @ METRIC_WEIGHTS
+    full_quality, full_metrics = float(quality_scores[0]), qualities[0][1]
+
+    impacts = compute_impacts(metric_matrix, METRIC_WEIGHTS)
+    impacts[uninformative] = 0.0
+    impacts = impacts.tolist()
+    per_source_metrics = pd.DataFrame(
+        metric_matrix[1:],
+        columns=[m.name for m in QUALITY_METRICS],
+        index=pd.Index([s.title for s in sources], name="source_title")
+    )
+    per_source_metrics["quality"] = quality_scores[1:]
+    per_source_metrics["impact"] = impacts
+
+    result = LOOResult(
         full_answer=full_answer,
         full_quality=full_quality,
         metric_breakdown=full_metrics,
         per_source_impact=impacts,
-        sources_meta=[{"id": s.id, "title": s.title, "url": s.url} for s in sources],
-        per_source_metrics=per_source_metrics 
+        sources_meta=sources_meta_array([{"id": s.id, "title": s.title, "url": s.url} for s in sources]),
+        per_source_metrics=per_source_metrics,
+        quality_scores=quality_scores
     )
+    # Failed judgements come back as NaN; don't pin them in the cache.
+    if not _has_failed_scores(result):
+        save_loo_result(cache_path, result)
+        remember_loo_query(query, sources_key, cache_path)
+    return result
+
+@_memoize_loo
+async def run_loo_async(
+    query: str,
+    urls: List[str],
+    exa_mocks: Dict[str, Dict[str, Any]]
+) -> LOOResult:
+    # Retrieval happens once, before any generation, so there is nothing to overlap it with.
+    sources = retrieve_sources(urls, exa_mocks)
+    return await evaluate_sources_async(query, sources)
+
+def run_loo(
+    query: str,
+    urls: List[str],
+    exa_mocks: Dict[str, Dict[str, Any]]
+) -> LOOResult:
+    return run_async(run_loo_async(query, urls, exa_mocks))
 
 if __name__ == "__main__":
     query = "How to choose best IELTS coaching center for first attempt?"
@@ -248,7 +1066,7 @@ if __name__ == "__main__":
         "https://www.upgrad.com/study-abroad/exam/ielts/top-ten-ielts-speaking-tips/"
     ]
     
-    exa_mocks =
+    exa_mocks = None
     
 #     exa_mocks = {
 # #     "https://careergridsacademy.com/how-to-improve-ielts-speaking-10-latest-tips/": {
@@ -668,21 +1486,19 @@ if __name__ == "__main__":
 
 # }
 
-    result = run_loo(query, urls, exa_mocks)
-
-    print("\n=== FINAL ANSWER ===\n")
-    print(result.full_answer)
-    print("\n=== METRICS ===")
-    print(result.metric_breakdown)
-    print("\n=== LOO IMPACT PER SOURCE ===")
-    for meta, imp in zip(result.sources_meta, result.per_source_impact):
-        print(f"{meta['title']} :: {imp:.3f}")
-        
-    # print("\n=== PER-SOURCE METRICS ===")
-    # for pm in result.per_source_metrics:
-    #     print(f"{pm['source_title']}: quality={pm['quality']:.3f}, ", end="")
-    #     for metric_name, metric_val in pm.items():
-    #         if metric_name in ("source_title","quality"):
-    #             continue
-    #         print(f"{metric_name}={metric_val:.3f} ", end="")
-    #     print()
+    result = run_async(run_loo_async(query, urls, exa_mocks))
+
+    lines = ["\n=== FINAL ANSWER ===\n", result.full_answer]
+    lines.append("\n=== METRICS ===")
+    lines.append(str(result.metric_breakdown))
+    lines.append("\n=== LOO IMPACT PER SOURCE ===")
+    for title, imp in zip(result.sources_meta["title"], result.per_source_impact):
+        lines.append(f"{title} :: {imp:.3f}")
+
+    lines.append("\n=== PER-SOURCE METRICS (answer without the source) ===")
+    for title, row in result.per_source_metrics.iterrows():
+        lines.append(f"{title}: " + " ".join(f"{name}={val:.3f}" for name, val in row.items()))
+    lines.append("\n=== MEAN OVER SOURCES ===")
+    lines.append(str(result.per_source_metrics.mean(axis=0).to_dict()))
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()